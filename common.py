@@ -1,17 +1,13 @@
+import importlib
 import os
-import re
-import subprocess
 import sys
 import json
+import math
 import time
-from urllib.parse import urlparse
-import uuid
-import requests
-import warnings
+import orjson
 
-import numpy as np
-from typing import Any, List, Tuple
-from glob import glob
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import stashapi.log as log
@@ -28,7 +24,12 @@ pluginhumanname = "SceneExport"
 # Configuration/settings file... because not everything can be easily built/controlled via the UI plugin settings
 # If you don't need this level of configuration, just define the default_settings here directly in code,
 #    and you can remove the _defaults.py file and the below code
-if not os.path.exists("config.py"):
+def _bootstrap_config():
+    """
+    The _bootstrap_config function creates config.py from the _defaults.py file on first use.
+
+    :return: Nothing
+    """
     with open(plugincodename + "_defaults.py", "r") as default:
         config_lines = default.readlines()
     with open("config.py", "w") as firstrun:
@@ -36,8 +37,17 @@ if not os.path.exists("config.py"):
         for line in config_lines:
             if not line.startswith("##"):
                 firstrun.write(f"#{line}")
+    importlib.invalidate_caches()
+
 
-import config
+# Only touch the disk when config.py is actually missing
+try:
+    import config
+except ModuleNotFoundError as e:
+    if e.name != "config":
+        raise
+    _bootstrap_config()
+    import config
 
 default_settings = config.default_settings
 
@@ -47,57 +57,71 @@ STASH_TMP = default_settings["stash_tmpdir"]
 STASH_LOGFILE = default_settings["stash_logfile"]
 OUTPUT_DIR = default_settings["output_dir"]
 
-warnings.filterwarnings("ignore")
-
-
-def stash_log(*args, **kwargs):
+# Directory paths normalized with a trailing separator
+_OUTPUT_DIR = os.path.join(OUTPUT_DIR, "")
+_STASH_TMP = os.path.join(STASH_TMP, "")
+
+# Only the scene fields read by extract_scene_metadata
+SCENE_FRAGMENT = "id title files { path duration } paths { sprite }"
+SCENE_BATCH_SIZE = 500
+# Keep concurrency low, Stash becomes unstable under heavier parallel load
+SCENE_FETCH_WORKERS = 4
+# Output file buffer, large enough to keep write() syscalls rare on big exports
+WRITE_BUFFER_SIZE = 2 * 1024 * 1024
+
+# stash_log level name -> log function
+_LOG_DISPATCH = {
+    "trace": log.trace,
+    "debug": log.debug,
+    "info": log.info,
+    "warn": log.warning,
+    "error": log.error,
+    "result": log.result,
+}
+
+
+def stash_log(*args, lvl="info", **kwargs):
     """
     The stash_log function is used to log messages from the script.
 
     :param *args: Pass in a list of arguments
+    :param lvl: The log level: trace, debug, info, warn, error, result or progress
     :param **kwargs: Pass in a dictionary of key-value pairs
     :return: The message
     :doc-author: Trelent
     """
-    messages = []
-    for input in args:
-        if not isinstance(input, str):
-            try:
-                messages.append(json.dumps(input, default=default_json))
-            except:
-                continue
-        else:
-            messages.append(input)
-    if len(messages) == 0:
-        return
-
-    lvl = kwargs["lvl"] if "lvl" in kwargs else "info"
-    message = " ".join(messages)
-
-    if lvl == "trace":
-        log.LEVEL = log.StashLogLevel.TRACE
-        log.trace(message)
-    elif lvl == "debug":
-        log.LEVEL = log.StashLogLevel.DEBUG
-        log.debug(message)
-    elif lvl == "info":
-        log.LEVEL = log.StashLogLevel.INFO
-        log.info(message)
-    elif lvl == "warn":
-        log.LEVEL = log.StashLogLevel.WARNING
-        log.warning(message)
-    elif lvl == "error":
-        log.LEVEL = log.StashLogLevel.ERROR
-        log.error(message)
-    elif lvl == "result":
-        log.result(message)
-    elif lvl == "progress":
+    if lvl == "progress":
         try:
             progress = min(max(0, float(args[0])), 1)
-            log.progress(str(progress))
-        except:
+            log.progress(progress)
+        except (ValueError, IndexError):
             pass
-    log.LEVEL = log.StashLogLevel.INFO
+        return
+
+    fn = _LOG_DISPATCH.get(lvl)
+    if fn is None:
+        return
+
+    if not args:
+        return
+    messages = [_format_log_arg(a) for a in args]
+
+    fn(" ".join(messages))
+
+
+def _format_log_arg(arg):
+    """
+    The _format_log_arg function renders a single stash_log argument, JSON-encoding anything that is not a string.
+
+    :param arg: Any: The argument to render
+    :return: The argument as a string, or its str() form if it cannot be encoded
+    """
+    if isinstance(arg, str):
+        return arg
+    try:
+        return orjson.dumps(arg, default=default_json, option=orjson.OPT_NON_STR_KEYS).decode()
+    except orjson.JSONEncodeError:
+        return str(arg)
 
 
 def default_json(t):
@@ -151,30 +175,6 @@ def exit_plugin(msg=None, err=None):
     sys.exit()
 
 
-def save_json(data, filename: str = "scene_metadata.json"):
-    """
-    The save_json function takes a dictionary and saves it to a JSON file.
-
-    :param data: dict: Pass in the data that will be saved to a json file
-    :param filename: str: Specify the name of the file that will be saved
-    :return: The file path of the saved json file
-    :doc-author: Trelent
-    """
-    directory = OUTPUT_DIR if OUTPUT_DIR.endswith(os.path.sep) else (OUTPUT_DIR + os.path.sep)
-    # Generate a unique filename
-    file_path = f"{directory}{filename}"
-
-    try:
-        with open(file_path, "w") as local_file:
-            json.dump(data, local_file)
-        stash_log(f"Downloaded and saved file to {file_path}", lvl="debug")
-    except requests.exceptions.RequestException as e:
-        stash_log(f"Failed to download file: {e}", lvl="error")
-        return None
-
-    return file_path
-
-
 def clear_tempdir():
     """
     The clear_tempdir function is used to clear the temporary directory of all files.
@@ -183,13 +183,22 @@ def clear_tempdir():
     :return: A boolean value
     :doc-author: Trelent
     """
-    tmpdir = STASH_TMP if STASH_TMP.endswith(os.path.sep) else (STASH_TMP + os.path.sep)
-    for f in glob(f"{tmpdir}*.jpg"):
-        try:
-            os.remove(f)
-        except OSError as e:
-            stash_log(f"could not remove {f}", lvl="error")
-            continue
+    tmpdir = _STASH_TMP
+    failed = 0
+    try:
+        with os.scandir(tmpdir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".jpg"):
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        failed += 1
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        stash_log(f"could not scan {tmpdir}: {e}", lvl="error")
+    if failed:
+        stash_log(f"could not remove {failed} files from {tmpdir}", lvl="error")
     stash_log("cleared temp directory.", lvl="debug")
 
 
@@ -212,64 +221,117 @@ def get_scenes_metadata(stash: StashInterface):
 
 
     :param stash: StashInterface: Pass the stashinterface object to the function
-    :return: A list of dictionaries with the following keys:
+    :return: The file path of the saved json file, or None if no scenes were found
     :doc-author: Trelent
     """
-    total = 1
-    counter = 0
-    batch = 120
-    results = []
-    while True:
-        counter += 1
-        _current, scenes = stash.find_scenes(f={}, filter={"per_page": 120, "page": counter}, get_count=True)
-
-        if counter == 1:
-            total = int(_current)
-            stash_log(f"found {total} scenes", lvl="info")
+    batch = SCENE_BATCH_SIZE
+    written = 0
+    file_path = os.path.join(_OUTPUT_DIR, f"stash_metadata_{time.time()}.json")
 
-        _current = batch * (counter - 1)
-
-        if _current >= total:
-            break
-
-        num_scenes = len(scenes)
-        # stash_log("scenes", scenes, lvl="trace")
-        stash_log(f"processing {num_scenes} / {_current} scenes", lvl="info")
+    # Only the first page needs the (expensive) total count
+    count, scenes = stash.find_scenes(
+        f={}, filter={"per_page": batch, "page": 1}, fragment=SCENE_FRAGMENT, get_count=True
+    )
+    total = int(count)
+    stash_log(f"found {total} scenes", lvl="info")
+    num_pages = math.ceil(total / batch)
 
-        for i in range(num_scenes):
-            scene = scenes[i]
-            _current -= 1
-            progress = (float(total) - float(_current)) / float(total)
-            stash_log(progress, lvl="progress")
+    last_progress_pct = -1
 
-            results.append(extract_scene_metadata(scene))
+    # Stream each scene to disk as it is extracted rather than buffering the full list.
+    # Write to a temporary name so a failed export never leaves a truncated file behind.
+    tmp_path = f"{file_path}.part"
+    try:
+        with open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE) as local_file:
+            local_file.write(b"[")
+            for scenes in iter_scene_pages(stash, scenes, num_pages, batch):
+                if not scenes:
+                    continue
+
+                # stash_log("scenes", scenes, lvl="trace")
+                stash_log(f"processing {written + len(scenes)} / {total} scenes", lvl="info")
+
+                # Encode the whole page in one pass and write it as a single chunk
+                if written:
+                    local_file.write(b",")
+                rows = [orjson.dumps(m, default=default_json) for m in map(extract_scene_metadata, scenes)]
+                local_file.write(b",".join(rows))
+                written += len(scenes)
+
+                # Only report progress when the whole percentage changes
+                pct = 100 * written // total
+                if pct != last_progress_pct:
+                    last_progress_pct = pct
+                    stash_log(written / total, lvl="progress")
+
+                stash_log("--end of loop--", lvl="debug")
+            local_file.write(b"]")
+        if written:
+            os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if written:
+        stash_log(f"saved {written} scenes to {file_path}", lvl="debug")
+        return file_path
+    return None
 
-        stash_log("--end of loop--", lvl="debug")
 
-    ts = time.time()
-    if results:
-        return save_json(results, f"stash_metadata_{ts}.json")
-    return None
+def iter_scene_pages(stash: StashInterface, first_page: list, num_pages: int, batch: int):
+    """
+    The iter_scene_pages function yields pages of scenes in page order.
+    The first page is passed in by the caller; the remaining pages are fetched concurrently, a bounded number ahead of the consumer.
 
+    :param stash: StashInterface: Pass the stashinterface object to the function
+    :param first_page: list: The already fetched scenes of page 1
+    :param num_pages: int: The total number of pages to yield
+    :param batch: int: The number of scenes per page
+    :return: A generator of lists of scene dictionaries
+    """
+    yield first_page
+    if num_pages < 2:
+        return
 
-def extract_scene_metadata(scene: dict):
+    executor = ThreadPoolExecutor(max_workers=SCENE_FETCH_WORKERS)
+    try:
+        pending = deque()
+        for page in range(2, num_pages + 1):
+            pending.append(
+                executor.submit(
+                    stash.find_scenes,
+                    f={},
+                    filter={"per_page": batch, "page": page},
+                    fragment=SCENE_FRAGMENT,
+                    get_count=False,
+                )
+            )
+            if len(pending) >= SCENE_FETCH_WORKERS * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Cancel queued fetches if the consumer stops early or a fetch fails
+        executor.shutdown(cancel_futures=True)
+
+
+def extract_scene_metadata(scene: dict, _basename=os.path.basename):
     """
     The extract_scene_metadata function takes a scene dictionary as input and returns a new dictionary containing the following keys:
         id: The unique identifier for the scene.
         title: The title of the scene, or if no title is provided, then it will be set to filename.
-        filename: The name of the file that contains this particular video clip.  This is extracted from path using os.path.basename().split(&quot;/&quot;)[-2].  Note that this assumes that all files are stored in subdirectories within your stash directory (e.g., /stash/scenes/&lt;filename&gt;).  If you have
+        filename: The name of the file that contains this particular video clip.  This is extracted from path using os.path.basename().  Note that this assumes that all files are stored in subdirectories within your stash directory (e.g., /stash/scenes/&lt;filename&gt;).  If you have
 
     :param scene: dict: Pass in the scene dictionary
     :return: A dictionary with the scene's id, title, filename, duration and sprites
     :doc-author: Trelent
     """
     file = scene["files"][0]
-    filename = os.path.basename(file["path"]).split("/")[-1]
-    metadata = {
+    filename = _basename(file["path"])
+    return {
         "id": scene["id"],
-        "title": scene["title"] if scene["title"] else filename,
+        "title": scene["title"] or filename,
         "filename": filename,
         "duration": file["duration"],
         "sprites": scene["paths"]["sprite"],
     }
-    return metadata
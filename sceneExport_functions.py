@@ -17,6 +17,7 @@ from common import (
 )
 
 try:
+    from requests.adapters import HTTPAdapter
     from stashapi.stashapp import StashInterface
 except ModuleNotFoundError:
     print(
@@ -38,6 +39,11 @@ def main():
     FRAGMENT_SERVER = json_input["server_connection"]
     stash = StashInterface(FRAGMENT_SERVER)
 
+    # StashInterface keeps one keep-alive session for all queries, retry dropped connections on it
+    adapter = HTTPAdapter(max_retries=2)
+    stash.s.mount("http://", adapter)
+    stash.s.mount("https://", adapter)
+
     ARGS = False
     PLUGIN_ARGS = False
 
@@ -45,13 +51,11 @@ def main():
     try:
         PLUGIN_ARGS = json_input["args"]["mode"]
         ARGS = json_input["args"]
-    except:
+    except (KeyError, TypeError):
         pass
 
-    # Check if the directory exists
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        stash_log(f"directory: '{OUTPUT_DIR}' created.", lvl="debug")
+    # Ensure the output directory exists
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     # Clear temp directory
     clear_tempdir()